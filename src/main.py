@@ -1,7 +1,11 @@
+import asyncio
+from array import array
 from decimal import Decimal
+import numpy as np
+import pandas as pd
 from pyspark.sql import SparkSession
-from pyspark.sql.types import DecimalType, DoubleType, LongType, StructField, StructType, StringType
-from web3 import Web3
+from pyspark.sql.types import DecimalType, DoubleType, LongType, StructField, StructType, StringType, TimestampType
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
 
 """
 gapohi 2025.
@@ -18,39 +22,148 @@ data or results obtained from the software. Users are responsible for conducting
 own research and making informed decisions.
 """
 
-def get_transactions(w3, from_block, latest_block, spark):
+MAX_CONCURRENT_REQUESTS = 32 ## maximum number of in-flight RPC requests, keeps the provider rate limits under control
+LOGS_BLOCK_RANGE = 50 ## maximum number of blocks requested in a single eth_getLogs call, keeps the provider response time bounded
+## fragments of the provider errors returned when an eth_getLogs range is too large or too dense, only these are retried with smaller ranges
+LOGS_RANGE_ERRORS = ("block range", "range too large", "too many results", "returned more than", "response size exceeded", "query timeout")
+
+## erc-20 transfers have a specific address and event signature
+TETHER_ADDRESS = Web3.to_checksum_address("0xdAC17F958D2ee523a2206206994597C13D831ec7") ## ERC-20 (Tether)
+TRANSFER_TOPIC = "0x" + Web3.keccak(text="Transfer(address,address,uint256)").hex() ## transfer event signature
+
+## (contract address, event signature) pairs whose logs are analyzed, all of them are fetched with a single request
+WATCHED_EVENTS = [
+    (TETHER_ADDRESS, TRANSFER_TOPIC)
+]
+
+USDT_DECIMALS = 6 ## Tether amounts are stored in the contract with 6 decimals (mwei)
+USDT_QUANTUM = Decimal("0.01") ## Tether amounts are rounded to 2 decimals
+
+## mixers are services that obscure the origin of cryptocurrency transactions by pooling and redistributing funds
+## these are some examples of mixers, may be obsolete
+MIXER_ADDRESSES = [
+    '0x5f4b5e8e6894e7b94b9b0d7b28b8011c18c04e1d',
+    '0x8fa7a7e8f79d3de88f8f3cfe69325425f94c12cf',
+    '0x0e83c9f1ec5f9d7a028b963907f490b30709d12c',
+    '0x9d1f522d5869c9b7ad864a29eb6e9f57a170d049',
+    '0x39ccecc9ebcc4ad3132a99893b28d7c890810149'
+]
+
+async def rpc_call(semaphore, request):
     """
-    Fetches blockchain transactions and computes gas fees.
+    Awaits an RPC request once a slot of the concurrency semaphore is available.
+    """
+    async with semaphore:
+        return await request
+
+async def fetch_block(w3, semaphore, block_number):
+    """
+    Fetches a block with its full transactions and the receipts of the block.
+    """
+    try:
+        block = await rpc_call(semaphore, w3.eth.get_block(block_number, full_transactions=True)) ## fetch block with full transactions
+    except Exception as e:
+        raise Exception(f"Error fetching block {block_number}: {e}")
+    try:
+        receipts = await rpc_call(semaphore, w3.eth.get_block_receipts(block_number)) ## fetch all the block receipts in a single call
+    except Exception as e:
+        raise Exception(f"Error fetching block receipts for block {block_number}: {e}")
+    ## receipts are paired with the block transactions by position, so both the count and the order are validated
+    if len(receipts) != len(block.transactions):
+        raise Exception(f"Error fetching block receipts for block {block_number}: expected {len(block.transactions)} receipts, got {len(receipts)}")
+    for tx, tx_receipt in zip(block.transactions, receipts):
+        if tx_receipt['transactionHash'] != tx['hash']:
+            raise Exception(f"Error fetching block receipts for block {block_number}: receipt {tx_receipt['transactionHash'].hex()} does not match transaction {tx['hash'].hex()}")
+    return block, receipts
+
+async def fetch_logs_range(w3, semaphore, filter_params, from_block, to_block):
+    """
+    Fetches the logs of a block range, splitting the range in halves when it is too large or too dense for the provider.
+    """
+    try:
+        return await rpc_call(semaphore, w3.eth.get_logs({**filter_params, 'fromBlock': from_block, 'toBlock': to_block})) ## fetch logs based on filter parameters
+    except Exception as e:
+        ## dense ranges can time out or exceed the provider result limits, so only those are retried as two smaller ranges
+        ## any other error (authentication, bad parameters, rate limits...) is raised right away
+        is_range_error = isinstance(e, (asyncio.TimeoutError, TimeoutError)) or any(fragment in str(e).lower() for fragment in LOGS_RANGE_ERRORS)
+        if not is_range_error or from_block == to_block:
+            raise Exception(f"Error fetching logs for blocks {from_block}-{to_block}: {e}")
+    middle_block = (from_block + to_block) // 2
+    first_half_logs, second_half_logs = await asyncio.gather(
+        fetch_logs_range(w3, semaphore, filter_params, from_block, middle_block),
+        fetch_logs_range(w3, semaphore, filter_params, middle_block + 1, to_block)
+    )
+    return first_half_logs + second_half_logs
+
+async def fetch_logs(w3, semaphore, from_block, latest_block):
+    """
+    Fetches the logs of every watched contract event and splits them by contract and event.
+    """
+    ## set filter parameters for logs, matching any of the watched contracts and any of the watched events
+    filter_params = {
+        'address': sorted({address for address, _ in WATCHED_EVENTS}),
+        'topics': [sorted({topic for _, topic in WATCHED_EVENTS})]
+    }
+
+    ## fetch the logs concurrently in bounded block ranges, keeping the block order
+    block_ranges = [(start_block, min(start_block + LOGS_BLOCK_RANGE - 1, latest_block)) for start_block in range(from_block, latest_block + 1, LOGS_BLOCK_RANGE)]
+    range_logs = await asyncio.gather(*(fetch_logs_range(w3, semaphore, filter_params, start_block, end_block) for start_block, end_block in block_ranges))
+    logs = [log for block_range_logs in range_logs for log in block_range_logs]
+
+    ## split the logs by contract and event, skipping the address and topic combinations that are not watched
+    logs_by_event = {event: [] for event in WATCHED_EVENTS}
+    for log in logs:
+        event = (log['address'], "0x" + log['topics'][0].hex())
+        if event in logs_by_event:
+            logs_by_event[event].append(log)
+    return logs_by_event
+
+def compute_gas_fees(gas_prices_wei, gas_used_units, values_wei):
+    """
+    Converts gas prices and values from Wei to Ether and computes the gas fees, vectorized over all the transactions.
     """
-    transactions = []
     wei_to_eth = 10**18 ## conversion factor from Wei to Ether
+    gas_price = np.array(gas_prices_wei, dtype=np.float64) / wei_to_eth ## convert gas price to Ether
+    gas_used = np.array(gas_used_units, dtype=np.int64)
+    gas_fee = gas_price * gas_used ## calculate the gas fee
+    value = np.array(values_wei, dtype=np.float64) / wei_to_eth ## convert value in wei to eth
+    return gas_price, gas_used, gas_fee, value
+
+def get_transactions(blocks, receipts, spark):
+    """
+    Computes gas fees of the fetched blockchain transactions.
+    """
+    ## transaction data is collected column by column, numeric columns in typed arrays and amounts in Wei
+    ## gas prices and values are uint256 amounts that can exceed 64-bit integers, so they are stored as floats
+    block_numbers, timestamps, gas_used_units, gas_prices_wei, values_wei = array('q'), array('q'), array('q'), array('d'), array('d')
+    from_addresses, to_addresses, transaction_hashes = [], [], []
     ## loop through blocks in the specified range
-    for block_number in range(from_block, latest_block + 1):
-        try:
-            block = w3.eth.get_block(block_number, full_transactions=True) ## fetch block with full transactions
-        except Exception as e:
-            raise Exception(f"Error fetching block {block_number}: {e}")
-        ## loop through each transaction in the block
-        for tx in block.transactions:
-            try:
-                tx_receipt = w3.eth.get_transaction_receipt(tx['hash'])
-                gas_price = tx['gasPrice'] / wei_to_eth ## convert gas price to Ether
-                gas_used = tx_receipt['gasUsed'] ## get the gas used in the transaction
-                gas_fee = gas_price * gas_used ## calculate the gas fee
-                ## append relevant transaction data to the transactions list
-                transactions.append({
-                    "block_number": block_number,
-                    "timestamp": block.timestamp,
-                    "from_address": tx['from'], 
-                    "to_address": tx['to'],
-                    "value": tx['value'] / wei_to_eth, ## convert value in wei to eth
-                    "transaction_hash": tx['hash'].hex(), ## every transaction has a unique hash
-                    "gas_price": gas_price,
-                    "gas_used": gas_used,
-                    "gas_fee": gas_fee
-                })
-            except Exception as e:
-                raise Exception(f"Error fetching block transactions for block {block_number}: {e}")
+    for block_number, block in blocks.items():
+        ## loop through each transaction in the block along with its receipt
+        for tx, tx_receipt in zip(block.transactions, receipts[block_number]):
+            ## append relevant transaction data to the transaction columns
+            block_numbers.append(block_number)
+            timestamps.append(block.timestamp)
+            from_addresses.append(tx['from'])
+            to_addresses.append(tx['to'])
+            values_wei.append(tx['value'])
+            transaction_hashes.append(tx['hash'].hex()) ## every transaction has a unique hash
+            gas_prices_wei.append(tx['gasPrice'])
+            gas_used_units.append(tx_receipt['gasUsed']) ## get the gas used in the transaction
+    ## unit conversions and gas fees are computed for all the transactions at once
+    gas_price, gas_used, gas_fee, value = compute_gas_fees(gas_prices_wei, gas_used_units, values_wei)
+    ## string columns are typed explicitly so an empty window is still converted through Arrow
+    transactions = pd.DataFrame({
+        "block_number": np.array(block_numbers, dtype=np.int64),
+        "timestamp": np.array(timestamps, dtype=np.int64),
+        "from_address": pd.Series(from_addresses, dtype=object),
+        "to_address": pd.Series(to_addresses, dtype=object),
+        "value": value,
+        "transaction_hash": pd.Series(transaction_hashes, dtype=object),
+        "gas_price": gas_price,
+        "gas_used": gas_used,
+        "gas_fee": gas_fee
+    })
     ## define Spark schema for the transaction data
     schema_block = StructType([
         StructField("block_number", LongType(), True),
@@ -63,50 +176,40 @@ def get_transactions(w3, from_block, latest_block, spark):
         StructField("gas_used", LongType(), True),
         StructField("gas_fee", DoubleType(), True)
     ])
-    ## return the transaction data as a Spark DataFrame
+    ## return the transaction data as a Spark DataFrame, converted through Arrow
     return spark.createDataFrame(transactions, schema=schema_block)
 
-def get_logs_tether(w3, from_block, latest_block, spark):
+def get_logs_tether(logs, blocks, spark):
     """
-    Fetches Tether ERC-20 transfer logs.
+    Processes the fetched Tether ERC-20 transfer logs.
     """
-    ## erc-20 transfers have a specific address and event signature
-    contract_address = w3.to_checksum_address("0xdAC17F958D2ee523a2206206994597C13D831ec7")  ## ERC-20 (Tether)
-    transfer_event_signature = "0x" + Web3.keccak(text="Transfer(address,address,uint256)").hex() ## transfer event signature
-    ## set filter parameters for logs
-    filter_params = {
-        'fromBlock': from_block,
-        'toBlock': latest_block,
-        'address': contract_address,
-        'topics': [transfer_event_signature]
-    }
-
-    try:
-        logs = w3.eth.get_logs(filter_params) ## fetch logs based on filter parameters
-    except Exception as e:
-        raise Exception(f"Error fetching logs: {e}")
-    
-    logs_tether = []
+    ## log data is collected column by column, numeric columns in typed arrays
+    block_numbers, timestamps = array('q'), array('q')
+    from_addresses, to_addresses, values_usdt, transaction_hashes = [], [], [], []
     ## loop through each log
     for log in logs:
         try:
             value_in_wei = int.from_bytes(log['data'], byteorder='big') ## convert data to value in Wei
-            value_usdt = round(w3.from_wei(value_in_wei, 'mwei'), 2) ## convert Wei to USDT
-            value_usdt_decimal = Decimal(str(value_usdt)) ## convert to Decimal
-            block_info = w3.eth.get_block(log['blockNumber']) ## fetch block info
-            block_timestamp = block_info.timestamp
-            log = {
-                "block_number": log['blockNumber'],
-                "timestamp": block_timestamp,
-                "from_address": "0x" + log['topics'][1].hex()[-40:], ## extracts the last 40 characters (20 bytes) of the topic's hex, representing an Ethereum address
-                "to_address": "0x" + log['topics'][2].hex()[-40:],
-                "value_usdt": value_usdt_decimal,
-                "transaction_hash": log['transactionHash'].hex() ## every transaction has a unique hash
-            }
-            ## append log to list
-            logs_tether.append(log)
+            value_usdt_decimal = Decimal(value_in_wei).scaleb(-USDT_DECIMALS).quantize(USDT_QUANTUM) ## convert Wei to USDT, rounded to 2 decimals
+            block_timestamp = blocks[log['blockNumber']].timestamp ## the logs blocks were already fetched with the transactions
+            ## append log data to the log columns
+            block_numbers.append(log['blockNumber'])
+            timestamps.append(block_timestamp)
+            from_addresses.append("0x" + log['topics'][1][-20:].hex()) ## extracts the last 20 bytes of the topic, representing an Ethereum address
+            to_addresses.append("0x" + log['topics'][2][-20:].hex())
+            values_usdt.append(value_usdt_decimal)
+            transaction_hashes.append(log['transactionHash'].hex()) ## every transaction has a unique hash
         except Exception as e:
             raise Exception(f"Error processing log {log['transactionHash']}: {e}")
+    ## string and Decimal columns are typed explicitly so an empty window is still converted through Arrow
+    logs_tether = pd.DataFrame({
+        "block_number": np.array(block_numbers, dtype=np.int64),
+        "timestamp": np.array(timestamps, dtype=np.int64),
+        "from_address": pd.Series(from_addresses, dtype=object),
+        "to_address": pd.Series(to_addresses, dtype=object),
+        "value_usdt": pd.Series(values_usdt, dtype=object),
+        "transaction_hash": pd.Series(transaction_hashes, dtype=object)
+    })
     ## define Spark schema for the log data
     schema_logs = StructType([
         StructField("block_number", LongType(), True),
@@ -116,7 +219,7 @@ def get_logs_tether(w3, from_block, latest_block, spark):
         StructField("value_usdt", DecimalType(38, 2), True),
         StructField("transaction_hash", StringType(), True)
     ])
-    ## return the log data as a Spark DataFrame
+    ## return the log data as a Spark DataFrame, converted through Arrow
     return spark.createDataFrame(logs_tether, schema=schema_logs)
 
 def transactions_queries(spark):
@@ -147,12 +250,31 @@ def transactions_queries(spark):
     print('Top 10 transactions by value:\n')
     tx_value_eth_top_10.show()
 
+    ## count transactions by hash, timestamp, sender and receiver in a single pass with grouping sets
+    ## the aggregated counts are cached and every frequency report below reads its own grouping from them
+    transaction_counts = spark.sql("""
+        SELECT 
+            CASE
+                WHEN GROUPING(transaction_hash) = 0 THEN 'transaction_hash'
+                WHEN GROUPING(timestamp) = 0 THEN 'timestamp'
+                WHEN GROUPING(tx_from_address) = 0 THEN 'tx_from_address'
+                ELSE 'tx_to_address'
+            END AS grouped_by,
+            transaction_hash,
+            timestamp,
+            tx_from_address,
+            tx_to_address,
+            COUNT(*) AS n_transactions
+        FROM df_transactions_complete
+        GROUP BY GROUPING SETS ((transaction_hash), (timestamp), (tx_from_address), (tx_to_address));
+    """).cache()
+    transaction_counts.createOrReplaceTempView("transaction_counts")
+
     ## get duplicated transaction hashes
     duplicated_transaction_hash = spark.sql("""
-        SELECT transaction_hash, COUNT(*) AS n_transactions
-        FROM df_transactions_complete
-        GROUP BY transaction_hash
-        HAVING n_transactions > 1
+        SELECT transaction_hash, n_transactions
+        FROM transaction_counts
+        WHERE grouped_by = 'transaction_hash' AND n_transactions > 1
         ORDER BY n_transactions DESC
         LIMIT 10;
     """)
@@ -161,9 +283,9 @@ def transactions_queries(spark):
 
     ## get top 10 activity peaks by timestamp
     activity_peaks_top_10 = spark.sql("""
-        SELECT timestamp, COUNT(*) AS n_transactions
-        FROM df_transactions_complete
-        GROUP BY timestamp
+        SELECT timestamp, n_transactions
+        FROM transaction_counts
+        WHERE grouped_by = 'timestamp'
         ORDER BY n_transactions DESC
         LIMIT 10;
     """)
@@ -185,75 +307,49 @@ def transactions_queries(spark):
     print('Top 10 transactions by gas fee:\n')
     gas_fee_top_10.show(truncate=False)
 
-    ## check if the sender's address (tx_from_address) is associated with known mixers  
-    ## mixers are services that obscure the origin of cryptocurrency transactions by pooling and redistributing funds
-    ## these are some examples of mixers, may be obsolete
-    mixers_use_from = spark.sql("""
-        SELECT 
-            tx_from_address,
+    ## check if the sender's (tx_from_address) or receiver's (tx_to_address) address is associated with known mixers
+    ## both addresses are unpivoted with stack() so a single scan and aggregation covers the two directions
+    ## the mixers are broadcast and matched with a hash join, so the lookup cost does not grow with the number of mixers
+    mixers = spark.createDataFrame([(address,) for address in MIXER_ADDRESSES], schema="address STRING")
+    mixers.createOrReplaceTempView("mixers")
+    mixers_use = spark.sql("""
+        SELECT /*+ BROADCAST(m) */
+            tx_addresses.direction,
+            tx_addresses.address,
             COUNT(*) AS n_transactions
-        FROM df_transactions_complete
-        WHERE 
-            tx_from_address in (
-            '0x5f4b5e8e6894e7b94b9b0d7b28b8011c18c04e1d',
-            '0x8fa7a7e8f79d3de88f8f3cfe69325425f94c12cf',
-            '0x0e83c9f1ec5f9d7a028b963907f490b30709d12c',
-            '0x9d1f522d5869c9b7ad864a29eb6e9f57a170d049',
-            '0x39ccecc9ebcc4ad3132a99893b28d7c890810149'
-            )
-        GROUP BY tx_from_address
-        ORDER BY n_transactions DESC;
+        FROM (
+            SELECT stack(2, 'from', tx_from_address, 'to', tx_to_address) AS (direction, address)
+            FROM df_transactions_complete
+        ) AS tx_addresses
+        JOIN mixers AS m
+            ON tx_addresses.address = m.address
+        GROUP BY tx_addresses.direction, tx_addresses.address
+        ORDER BY tx_addresses.direction, n_transactions DESC;
     """)
-    print('Mixers use by from_address:\n')
-    mixers_use_from.show(truncate=False)
-
-    ## check if the receiver's address (tx_to_address) is associated with know mixers
-    mixers_use_to = spark.sql("""
-        SELECT
-            tx_to_address,
-            COUNT(*) AS n_transactions
-        FROM df_transactions_complete
-        WHERE 
-            tx_to_address in (
-            '0x5f4b5e8e6894e7b94b9b0d7b28b8011c18c04e1d',
-            '0x8fa7a7e8f79d3de88f8f3cfe69325425f94c12cf',
-            '0x0e83c9f1ec5f9d7a028b963907f490b30709d12c',
-            '0x9d1f522d5869c9b7ad864a29eb6e9f57a170d049',
-            '0x39ccecc9ebcc4ad3132a99893b28d7c890810149'
-            )
-        GROUP BY tx_to_address
-        ORDER BY n_transactions DESC;
-    """)
-    print('Mixers use by to_address:\n')
-    mixers_use_to.show(truncate=False)
+    print('Mixers use by from_address and to_address:\n')
+    mixers_use.show(truncate=False)
 
     ## calculate time between blocks
-    time_between_blocks = spark.sql("""
-    WITH grouped_data AS (
-        SELECT 
-            block_number,
-            timestamp,
-            MAX(unix_timestamp) AS unix_timestamp
-        FROM df_transactions_complete
-        GROUP BY block_number, timestamp
-        ORDER BY block_number, timestamp
-    ),
-    timediff_data AS (
-        SELECT
-            block_number,
-            timestamp,
-            unix_timestamp,
-            LAG(unix_timestamp) OVER (ORDER BY block_number) as unix_prev_timestamp
-        FROM grouped_data
-    )
-    SELECT 
+    ## every block has a single timestamp, so the list of blocks is tiny and the differences are computed locally
+    ## instead of with a window ordered over the whole data in a single Spark partition
+    block_times = spark.sql("""
+    SELECT DISTINCT
         block_number,
         timestamp,
-        unix_timestamp,
-        unix_prev_timestamp,
-        COALESCE((unix_timestamp-unix_prev_timestamp), 0) AS time_diff_in_seconds
-    FROM timediff_data;
-    """)
+        unix_timestamp
+    FROM df_transactions_complete;
+    """).toPandas().sort_values("block_number", ignore_index=True)
+    block_times["unix_prev_timestamp"] = block_times["unix_timestamp"].shift().astype("Int64")
+    block_times["time_diff_in_seconds"] = (block_times["unix_timestamp"] - block_times["unix_prev_timestamp"]).fillna(0).astype("int64")
+    ## define Spark schema for the block times
+    schema_block_times = StructType([
+        StructField("block_number", LongType(), True),
+        StructField("timestamp", TimestampType(), True),
+        StructField("unix_timestamp", LongType(), True),
+        StructField("unix_prev_timestamp", LongType(), True),
+        StructField("time_diff_in_seconds", LongType(), True)
+    ])
+    time_between_blocks = spark.createDataFrame(block_times, schema=schema_block_times)
     time_between_blocks.createOrReplaceTempView("block_times")
     print('Time between blocks:\n')
     time_between_blocks.show(10)
@@ -274,10 +370,9 @@ def transactions_queries(spark):
     ## identify sender addresses with high transaction frequency
     from_address_freq = spark.sql("""
     SELECT 
-        tx_from_address, COUNT(*) AS n_transactions
-    FROM df_transactions_complete
-    GROUP BY tx_from_address
-    HAVING n_transactions > 1
+        tx_from_address, n_transactions
+    FROM transaction_counts
+    WHERE grouped_by = 'tx_from_address' AND n_transactions > 1
     ORDER BY n_transactions DESC
     LIMIT 10;
     """)
@@ -287,16 +382,17 @@ def transactions_queries(spark):
     ## identify receiver addresses with high transaction frequency
     to_address_freq = spark.sql("""
     SELECT 
-        tx_to_address, COUNT(*) AS n_transactions
-    FROM df_transactions_complete
-    GROUP BY tx_to_address
-    HAVING n_transactions > 1
+        tx_to_address, n_transactions
+    FROM transaction_counts
+    WHERE grouped_by = 'tx_to_address' AND n_transactions > 1
     ORDER BY n_transactions DESC
     LIMIT 10;
     """)
     print('Highly repeated directions (to):\n')
     to_address_freq.show(truncate=False)
 
+    transaction_counts.unpersist()
+
     return
 
 def tether_queries(spark):
@@ -327,11 +423,28 @@ def tether_queries(spark):
     print('Tether Top 10 transactions by value (USDT):\n')
     log_value_top_10.show()
 
+    ## count tether transactions by timestamp, sender and receiver in a single pass with grouping sets
+    log_counts = spark.sql("""
+        SELECT 
+            CASE
+                WHEN GROUPING(timestamp) = 0 THEN 'timestamp'
+                WHEN GROUPING(log_from_address) = 0 THEN 'log_from_address'
+                ELSE 'log_to_address'
+            END AS grouped_by,
+            timestamp,
+            log_from_address,
+            log_to_address,
+            COUNT(*) AS n_transactions
+        FROM df_logs_tether_clean
+        GROUP BY GROUPING SETS ((timestamp), (log_from_address), (log_to_address));
+    """).cache()
+    log_counts.createOrReplaceTempView("log_counts")
+
     ## get top 10 activity peaks by number of transactions
     log_activity_peaks_top_10 = spark.sql("""
-        SELECT timestamp, COUNT(*) AS n_transactions
-        FROM df_logs_tether_clean
-        GROUP BY timestamp
+        SELECT timestamp, n_transactions
+        FROM log_counts
+        WHERE grouped_by = 'timestamp'
         ORDER BY n_transactions DESC
         LIMIT 10;
     """)
@@ -341,10 +454,9 @@ def tether_queries(spark):
     ## find top 10 most frequent 'from' addresses
     log_from_address_freq = spark.sql("""
     SELECT 
-        log_from_address, COUNT(*) AS n_transactions
-    FROM df_logs_tether_clean
-    GROUP BY log_from_address
-    HAVING n_transactions > 1
+        log_from_address, n_transactions
+    FROM log_counts
+    WHERE grouped_by = 'log_from_address' AND n_transactions > 1
     ORDER BY n_transactions DESC
     LIMIT 10;
     """)
@@ -354,17 +466,18 @@ def tether_queries(spark):
     ## find top 10 most frequent 'to' addresses
     log_to_address_freq = spark.sql("""
     SELECT 
-        log_to_address, COUNT(*) AS n_transactions
-    FROM df_logs_tether_clean
-    GROUP BY log_to_address
-    HAVING n_transactions > 1
+        log_to_address, n_transactions
+    FROM log_counts
+    WHERE grouped_by = 'log_to_address' AND n_transactions > 1
     ORDER BY n_transactions DESC
     LIMIT 10;
     """)
     print('Tether Highly repeated directions (to):\n')
     log_to_address_freq.show(truncate=False)
 
-    ## gas fee comparison between general and tether transactions
+    log_counts.unpersist()
+
+    ## gas fee comparison between general and tether transactions, both read from their cached pre-filtered data
     gas_comparison = spark.sql("""
     SELECT 
         'general_transactions' AS table,
@@ -372,8 +485,7 @@ def tether_queries(spark):
         MAX(tx_gas_fee_eth)AS max_gas_fee,
         AVG(tx_gas_fee_eth)AS avg_gas_fee,
         STDDEV(tx_gas_fee_eth) AS stddev_gas_fee
-    FROM df_transactions_complete
-    WHERE log_value_usdt IS NULL 
+    FROM df_general_only
     UNION ALL
     SELECT 
         'tether_transactions' AS table,
@@ -399,34 +511,67 @@ def tether_queries(spark):
 
     return
 
+async def fetch_ethereum_data():
+    """
+    Connects to Ethereum and fetches the blocks, receipts and watched event logs of the latest blocks concurrently.
+    """
+    ## connect to Ethereum network using Alchemy provider
+    w3 = AsyncWeb3(AsyncHTTPProvider("https://eth-mainnet.g.alchemy.com/v2/PERSONAL_KEY_TO_ALCHEMY"))
+    try:
+        ## check if the connection to Ethereum is successful
+        if await w3.is_connected():
+            print("✅ Connected to Ethereum\n")
+        else:
+            print("❌ Connection failed\n")
+
+        ## get the latest block number and define range of blocks to analyze
+        latest_block = await w3.eth.block_number
+        from_block = latest_block - 9 ## select number of blocks
+
+        ## every RPC request shares the same concurrency limit
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        ## fetch every block once along with its receipts, and the watched event logs of the same range
+        block_numbers = range(from_block, latest_block + 1)
+        fetched_blocks, logs_by_event = await asyncio.gather(
+            asyncio.gather(*(fetch_block(w3, semaphore, block_number) for block_number in block_numbers)),
+            fetch_logs(w3, semaphore, from_block, latest_block)
+        )
+    finally:
+        ## close the provider HTTP session before the event loop is closed
+        await w3.provider.disconnect()
+    blocks = {block_number: block for block_number, (block, _) in zip(block_numbers, fetched_blocks)}
+    receipts = {block_number: block_receipts for block_number, (_, block_receipts) in zip(block_numbers, fetched_blocks)}
+    return blocks, receipts, logs_by_event
+
 def main():
-    ## create Spark session and set log level to ERROR
-    spark = SparkSession.builder.appName("Ethereum Transactions").getOrCreate()
+    ## create Spark session with Arrow-based pandas conversion and set log level to ERROR
+    ## the analyzed data only has a few thousand rows, so shuffles use few partitions and adaptive execution coalesces them further
+    spark = (
+        SparkSession.builder
+        .appName("Ethereum Transactions")
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .config("spark.sql.shuffle.partitions", "4")
+        .config("spark.sql.adaptive.enabled", "true")
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true")
+        .getOrCreate()
+    )
     spark.sparkContext.setLogLevel("ERROR")
 
-    ## connect to Ethereum network using Alchemy provider
-    w3 = Web3(Web3.HTTPProvider("https://eth-mainnet.g.alchemy.com/v2/PERSONAL_KEY_TO_ALCHEMY"))
-    ## check if the connection to Ethereum is successful
-    if w3.is_connected():
-        print("✅ Connected to Ethereum\n")
-    else:
-        print("❌ Connection failed\n")
-
-    ## get the latest block number and define range of blocks to analyze
-    latest_block = w3.eth.block_number
-    from_block = latest_block - 9 ## select number of blocks
-
-    ## get Ethereum transactions and create a Spark temporary view
-    df_transactions = get_transactions(w3, from_block, latest_block, spark)
+    ## fetch Ethereum blocks, receipts and watched event logs
+    blocks, receipts, logs_by_event = asyncio.run(fetch_ethereum_data())
+
+    ## get Ethereum transactions, in a single partition, and create a Spark temporary view
+    df_transactions = get_transactions(blocks, receipts, spark).coalesce(1)
     df_transactions.createOrReplaceTempView("transactions")
 
-    ## get tether logs and create a Spark temporary view
-    df_logs_tether = get_logs_tether(w3, from_block, latest_block, spark)
+    ## get tether logs, in a single partition, and create a Spark temporary view
+    df_logs_tether = get_logs_tether(logs_by_event[(TETHER_ADDRESS, TRANSFER_TOPIC)], blocks, spark).coalesce(1)
     df_logs_tether.createOrReplaceTempView("logs_tether")
     
     ## join transactions with tether logs and create a new view for complete transaction data
+    ## tether logs are a small subset of the transactions, so they are broadcast to avoid shuffling both sides
     df_transactions_complete = spark.sql("""
-        SELECT 
+        SELECT /*+ BROADCAST(l) */
             t.block_number AS block_number, 
             t.timestamp AS unix_timestamp,
             from_utc_timestamp(FROM_UNIXTIME(t.timestamp), 'Europe/Madrid') AS timestamp, 
@@ -446,6 +591,9 @@ def main():
             AND t.block_number = l.block_number 
             AND t.timestamp = l.timestamp;
     """)
+    ## cache the joined data, every query reads from it, and count once to materialize it
+    df_transactions_complete = df_transactions_complete.cache()
+    df_transactions_complete.count()
     df_transactions_complete.createOrReplaceTempView("df_transactions_complete")
 
     ## filter the tether transactions to only include tether logs
@@ -454,8 +602,22 @@ def main():
         FROM df_transactions_complete
         WHERE log_value_usdt IS NOT NULL;                      
     """)
+    ## cache the tether transactions, every tether query reads from them
+    df_logs_tether_clean = df_logs_tether_clean.cache()
+    df_logs_tether_clean.count()
     df_logs_tether_clean.createOrReplaceTempView("df_logs_tether_clean")
 
+    ## filter the general transactions to only include transactions without tether logs
+    df_general_only = spark.sql("""
+        SELECT *
+        FROM df_transactions_complete
+        WHERE log_value_usdt IS NULL;
+    """)
+    ## cache the general transactions so the split is only computed once
+    df_general_only = df_general_only.cache()
+    df_general_only.count()
+    df_general_only.createOrReplaceTempView("df_general_only")
+
     print('\n')
     print('------------------------')
     print('GENERAL ETH TRANSACTIONS')
@@ -470,6 +632,11 @@ def main():
     print('\n')
     tether_queries(spark) ## execute Tether-related queries
 
+    ## free the cached data
+    df_general_only.unpersist()
+    df_logs_tether_clean.unpersist()
+    df_transactions_complete.unpersist()
+
     return
 
 if __name__ == "__main__":